@@ -12,16 +12,350 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import codecs
+import ast
+import copy
+import functools
+import itertools
+import json
+import keyword
+import math
 import os
+import sys
+import tempfile
+import types
 from collections.abc import Iterable, Mapping
-from typing import Any, Dict, Generic, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple
 
 import paddle
 import yaml
 
 from paddle3d.utils.logger import logger
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
+def _intern_strings(obj: Any) -> Any:
+    '''Intern the keys and `type` names of a parsed config, in place'''
+    if isinstance(obj, dict):
+        items = [(sys.intern(key) if isinstance(key, str) else key, val)
+                 for key, val in obj.items()]
+        obj.clear()
+        for key, val in items:
+            if key == 'type' and isinstance(val, str):
+                val = sys.intern(val)
+            obj[key] = _intern_strings(val)
+    elif isinstance(obj, list):
+        for idx, val in enumerate(obj):
+            obj[idx] = _intern_strings(val)
+    return obj
+
+
+# Parsed yaml files, keyed by canonical path and validated against mtime
+_YAML_CACHE = {}
+
+
+def _load_yaml(path: str, mtimes: Optional[Dict[str, int]] = None) -> Dict:
+    '''Load a yaml file, reusing the parsed result while the file is unchanged
+
+    If given, `mtimes` records the mtime the returned content was checked
+    against, keyed by the canonical path of the file.
+    '''
+    # Let the OS resolve `..` after symlinks, as opening the path directly does
+    realpath = os.path.realpath(path)
+    mtime = os.stat(realpath).st_mtime_ns
+    if mtimes is not None:
+        mtimes[realpath] = mtime
+
+    cached = _YAML_CACHE.get(realpath)
+    if cached is None or cached[0] != mtime:
+        # Hand the raw bytes to the loader and let it decode them in one go
+        with open(path, 'rb') as file:
+            dic = _intern_strings(yaml.load(file.read(), Loader=_Loader))
+        cached = _YAML_CACHE[realpath] = (mtime, dic)
+
+    return copy.deepcopy(cached[1])
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_base(path: str, base_path: str) -> str:
+    '''Resolve the `_base_` entry of the config at `path` relative to its directory'''
+    # Not normalized, `..` must be resolved by the OS after following symlinks
+    return os.path.join(os.path.dirname(path), base_path)
+
+
+def _sidecar_path(path: str) -> str:
+    return '{}.cache.json'.format(path)
+
+
+def _mtimes_match(mtimes: Dict[str, int]) -> bool:
+    '''Check that none of the recorded source files changed'''
+    try:
+        return all(
+            os.stat(source).st_mtime_ns == mtime
+            for source, mtime in mtimes.items())
+    except (OSError, AttributeError, TypeError):
+        return False
+
+
+def _load_sidecar(path: str) -> Optional[Tuple[Dict, Dict[str, int]]]:
+    '''Load the flattened config cached next to `path` and the mtimes of its
+    source files, if it is still valid'''
+    try:
+        with open(_sidecar_path(path), 'r', encoding='utf-8') as file:
+            sidecar = json.load(file)
+        source = sidecar['source']
+        mtimes, dic = sidecar['mtimes'], sidecar['dic']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    # A sidecar copied along with its config still describes the original file
+    if source != os.path.realpath(path):
+        return None
+
+    if not isinstance(dic, dict) or not _mtimes_match(mtimes):
+        return None
+
+    return _intern_strings(dic), mtimes
+
+
+def _dump_sidecar(path: str, dic: Dict, mtimes: Dict[str, int]):
+    '''Cache the flattened config next to `path`, ignoring unwritable locations
+
+    `mtimes` must be the mtimes the sources were checked against when parsed,
+    so a file saved after parsing invalidates the sidecar.
+    '''
+    try:
+        data = json.dumps({
+            'source': os.path.realpath(path),
+            'mtimes': mtimes,
+            'dic': dic
+        })
+    except (TypeError, ValueError):
+        return
+
+    # json turns non-string keys into strings, only cache exact round-trips
+    if json.loads(data)['dic'] != dic:
+        return
+
+    _atomic_write(_sidecar_path(path), data)
+
+
+def _atomic_write(path: str, data: str) -> bool:
+    '''Write data to path through a temporary file, return False if it is not writable'''
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', suffix='.tmp')
+    except OSError:
+        return False
+
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(data)
+        # Readers never see a partially written file
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+# Component names exported by paddle, used as fallbacks to the paddle3d managers
+_PADDLE_LR_NAMES = frozenset(paddle.optimizer.lr.__all__)
+_PADDLE_OPT_NAMES = frozenset(paddle.optimizer.__all__)
+_PADDLE_NN_NAMES = frozenset(paddle.nn.__all__)
+
+# Maps component names to the paddle3d manager that registered them, rebuilt
+# whenever the number of registrations in the managers changes
+_COMPONENT_INDEX = {}
+_COMPONENT_INDEX_VERSION = -1
+
+
+def _build_component_index() -> Dict:
+    # lazy import
+    import paddle3d.apis.manager as manager
+
+    index = {}
+    for com in manager.__all__:
+        com = getattr(manager, com)
+        for com_name in com.components_dict:
+            # Keep the first manager in manager.__all__ that owns the name
+            index.setdefault(com_name, com)
+    return index
+
+
+def _get_component_manager(com_name: str) -> Optional[Any]:
+    '''Return the paddle3d manager that registered `com_name`, or None'''
+    # lazy import
+    import paddle3d.apis.manager as manager
+    global _COMPONENT_INDEX, _COMPONENT_INDEX_VERSION
+
+    version = manager.ComponentManager.registrations()
+    if version != _COMPONENT_INDEX_VERSION:
+        # Swap in a complete index so other threads never see a partial one
+        _COMPONENT_INDEX = _build_component_index()
+        _COMPONENT_INDEX_VERSION = version
+    return _COMPONENT_INDEX.get(com_name)
+
+
+# Keys consumed by _load_object rather than passed to the component
+_META_KEYS = ('type', '_lazy_')
+
+# Returned by Config._enter_object when obj still has children to build
+_PENDING = object()
+
+
+def _is_container(obj: Any) -> bool:
+    return isinstance(obj, Iterable) and not isinstance(obj, str)
+
+
+def _set_param(params, key: Any, value: Any):
+    if isinstance(params, list):
+        params.append(value)
+    else:
+        params[key] = value
+
+
+def _build_path(path: str) -> str:
+    return '{}.build.py'.format(path)
+
+
+# First lines of a generated builder, the config it was generated for and the
+# mtimes of its sources
+_BUILDER_HEADER = ('SOURCE = ', 'MTIMES = ')
+
+
+def _exec_builder(build_path: str, path: str) -> Optional[Dict]:
+    '''Execute the generated builder of the config at `path`, or return None if
+    it can not be used
+
+    The header is checked before anything in the file is executed, so builders
+    that are stale or were copied along with another config never run.
+    '''
+    try:
+        with open(build_path, 'r', encoding='utf-8') as file:
+            values = []
+            for prefix in _BUILDER_HEADER:
+                line = file.readline()
+                if not line.startswith(prefix):
+                    return None
+                values.append(ast.literal_eval(line[len(prefix):].strip()))
+
+            source, mtimes = values
+            if source != os.path.realpath(path) or not _mtimes_match(mtimes):
+                return None
+
+            file.seek(0)
+            code = file.read()
+    except (OSError, ValueError, SyntaxError):
+        return None
+
+    module = {'__name__': '_paddle3d_builder', '__file__': build_path}
+    try:
+        exec(compile(code, build_path, 'exec'), module)
+    except Exception:
+        # Builders may refer to components that were moved or removed
+        return None
+    return module
+
+
+class _BuilderWriter(object):
+    '''Write python source that builds a config object without going through Config
+
+    The emitted `build` function creates the components in the same order as
+    Config._load_object does, children before their parents and in key order.
+    '''
+
+    def __init__(self, load_component: Callable[[str], Any]):
+        self._load_component = load_component
+        self._aliases = {}
+        self._imports = []
+        self._names = itertools.count()
+
+    def write(self, obj: Any, source: str, mtimes: Dict[str, int]) -> str:
+        body = []
+        result = self._emit(obj, body, '    ')
+        lines = [
+            '{}{!r}'.format(_BUILDER_HEADER[0], source),
+            '{}{!r}'.format(_BUILDER_HEADER[1], mtimes),
+            '# Generated by paddle3d.apis.Config.compile, do not edit.', ''
+        ]
+        lines += self._imports
+        lines += ['', '', 'def build():']
+        lines += body
+        lines += ['    return {}'.format(result), '']
+        return '\n'.join(lines)
+
+    def _new_name(self, prefix: str = 'x') -> str:
+        return '{}{}'.format(prefix, next(self._names))
+
+    def _alias(self, component: Any) -> str:
+        if component in self._aliases:
+            return self._aliases[component]
+
+        module, qualname = component.__module__, component.__qualname__
+        if module == '__main__' or '<locals>' in qualname:
+            raise ValueError(
+                'Component {} can not be imported by a generated builder.'.
+                format(qualname))
+
+        alias = self._new_name('_c')
+        self._imports.append('import {} as {}_module'.format(module, alias))
+        self._imports.append('{0} = {0}_module.{1}'.format(alias, qualname))
+        self._aliases[component] = alias
+        return alias
+
+    def _emit(self, obj: Any, body: List[str], indent: str) -> str:
+        '''Append the statements building obj to body and return an expression for it'''
+        if isinstance(obj, Mapping):
+            if obj.get('_lazy_', False):
+                name = self._new_name('_lazy')
+                body.append('{}def {}():'.format(indent, name))
+                dic = {k: v for k, v in obj.items() if k != '_lazy_'}
+                result = self._emit(dic, body, indent + '    ')
+                body.append('{}    return {}'.format(indent, result))
+                return name
+
+            if 'type' in obj:
+                callee = self._alias(self._load_component(obj['type']))
+            else:
+                callee = 'dict'
+
+            params = [(key, self._emit(val, body, indent))
+                      for key, val in obj.items() if key not in _META_KEYS]
+            if all(
+                    isinstance(key, str) and key.isidentifier()
+                    and not keyword.iskeyword(key) for key, _ in params):
+                kwargs = ['{}={}'.format(key, val) for key, val in params]
+            else:
+                # Keep the argument order for keys that are not identifiers
+                kwargs = [
+                    '**{{{}}}'.format(', '.join(
+                        '{!r}: {}'.format(key, val) for key, val in params))
+                ]
+            code = '{}({})'.format(callee, ', '.join(kwargs))
+
+        elif _is_container(obj):
+            items = [self._emit(item, body, indent) for item in obj]
+            code = '[{}]'.format(', '.join(items))
+
+        elif isinstance(obj, float) and not math.isfinite(obj):
+            return "float('{}')".format(obj)
+
+        elif obj is None or isinstance(obj, (bool, int, float, str)):
+            return repr(obj)
+
+        else:
+            raise TypeError('Can not generate a builder for {!r}.'.format(obj))
+
+        name = self._new_name()
+        body.append('{}{} = {}'.format(indent, name, code))
+        return name
+
 
 class Config(object):
     '''Training configuration parsing. Only yaml/yml files are supported.
@@ -57,6 +391,9 @@ class Config(object):
         ...
     '''
 
+    __slots__ = ('dic', '_model', '_train_dataset', '_val_dataset',
+                 '_component_cache', '_sources')
+
     def __init__(self,
                  *,
                  path: str,
@@ -73,8 +410,17 @@ class Config(object):
         self._model = None
         self._train_dataset = None
         self._val_dataset = None
+        self._component_cache = {}
         if path.endswith('yml') or path.endswith('yaml'):
-            self.dic = self._parse_from_yaml(path)
+            sidecar = _load_sidecar(path)
+            if sidecar is not None:
+                self.dic, self._sources = sidecar
+            else:
+                # mtimes of every yaml file in the _base_ chain, keyed by their
+                # canonical paths
+                self._sources = {}
+                self.dic = self._parse_from_yaml(path, self._sources)
+                _dump_sidecar(path, self.dic, self._sources)
         else:
             raise RuntimeError('Config file should in yaml format!')
 
@@ -86,34 +432,34 @@ class Config(object):
 
     def _update_dic(self, dic: Dict, base_dic: Dict):
         '''Update config from dic based base_dic
-        '''
 
-        base_dic = base_dic.copy()
-        dic = dic.copy()
+        The top level of base_dic is merged in place, so the caller must own
+        it. Sub-dicts are copied before they are merged, since yaml anchors may
+        share them between several keys.
+        '''
 
         if dic.get('_inherited_', True) == False:
+            dic = dict(dic)
             dic.pop('_inherited_')
             return dic
 
         for key, val in dic.items():
             if isinstance(val, dict) and key in base_dic:
-                base_dic[key] = self._update_dic(val, base_dic[key])
+                base_dic[key] = self._update_dic(val, dict(base_dic[key]))
             else:
                 base_dic[key] = val
-        dic = base_dic
-        return dic
+        return base_dic
 
-    def _parse_from_yaml(self, path: str):
+    def _parse_from_yaml(self,
+                         path: str,
+                         sources: Optional[Dict[str, int]] = None):
         '''Parse a yaml file and build config'''
 
-        with codecs.open(path, 'r', 'utf-8') as file:
-            dic = yaml.load(file, Loader=yaml.FullLoader)
+        dic = _load_yaml(path, sources)
 
         if '_base_' in dic:
-            cfg_dir = os.path.dirname(path)
-            base_path = dic.pop('_base_')
-            base_path = os.path.join(cfg_dir, base_path)
-            base_dic = self._parse_from_yaml(base_path)
+            base_path = _resolve_base(path, dic.pop('_base_'))
+            base_dic = self._parse_from_yaml(base_path, sources)
             dic = self._update_dic(dic, base_dic)
         return dic
 
@@ -161,7 +507,8 @@ class Config(object):
 
     @property
     def optimizer(self) -> paddle.optimizer.Optimizer:
-        params = self.dic.get('optimizer', {}).copy()
+        # The only copy of the optimizer config, _load_object does not copy again
+        params = dict(self.dic.get('optimizer', {}))
 
         params['learning_rate'] = self.lr_scheduler
         params['parameters'] = self.model.parameters()
@@ -170,21 +517,25 @@ class Config(object):
 
     @property
     def model(self) -> paddle.nn.Layer:
-        model_cfg = self.dic.get('model').copy()
+        if self._model is not None:
+            return self._model
+
+        model_cfg = self.dic.get('model')
         if not model_cfg:
             raise RuntimeError('No model specified in the configuration file.')
 
-        if not self._model:
-            self._model = self._load_object(model_cfg)
+        self._model = self._load_object(model_cfg)
         return self._model
 
     @property
-    def train_dataset_config(self) -> Dict:
-        return self.dic.get('train_dataset', {}).copy()
+    def train_dataset_config(self) -> Mapping:
+        '''Read-only view of the training dataset config'''
+        return types.MappingProxyType(self.dic.get('train_dataset', {}))
 
     @property
-    def val_dataset_config(self) -> Dict:
-        return self.dic.get('val_dataset', {}).copy()
+    def val_dataset_config(self) -> Mapping:
+        '''Read-only view of the validation dataset config'''
+        return types.MappingProxyType(self.dic.get('val_dataset', {}))
 
     @property
     def train_dataset_class(self) -> Generic:
@@ -198,46 +549,58 @@ class Config(object):
 
     @property
     def train_dataset(self) -> paddle.io.Dataset:
-        _train_dataset = self.train_dataset_config
+        if self._train_dataset is not None:
+            return self._train_dataset
+
+        _train_dataset = self.dic.get('train_dataset')
         if not _train_dataset:
             return None
-        if not self._train_dataset:
-            self._train_dataset = self._load_object(_train_dataset)
+        self._train_dataset = self._load_object(_train_dataset)
         return self._train_dataset
 
     @property
     def val_dataset(self) -> paddle.io.Dataset:
-        _val_dataset = self.val_dataset_config
+        if self._val_dataset is not None:
+            return self._val_dataset
+
+        _val_dataset = self.dic.get('val_dataset')
         if not _val_dataset:
             return None
-        if not self._val_dataset:
-            self._val_dataset = self._load_object(_val_dataset)
+        self._val_dataset = self._load_object(_val_dataset)
         return self._val_dataset
 
     def _load_component(self, com_name: str) -> Any:
-        # lazy import
-        import paddle3d.apis.manager as manager
+        component = self._component_cache.get(com_name)
+        if component is None:
+            component = self._search_component(com_name)
+            self._component_cache[com_name] = component
+        return component
 
-        if com_name.lower().startswith('$paddleseg'):
-            return self._load_component_from_paddleseg(com_name[11:])
+    def _search_component(self, com_name: str) -> Any:
+        # Only names with a `$` prefix can refer to external components
+        if com_name.startswith('$'):
+            prefix = com_name[:10].lower()
+            if prefix == '$paddleseg':
+                return self._load_component_from_paddleseg(com_name[11:])
 
-        if com_name.lower().startswith('$paddledet'):
-            return self._load_component_from_paddledet(com_name[11:])
+            if prefix == '$paddledet':
+                return self._load_component_from_paddledet(com_name[11:])
 
-        for com in manager.__all__:
-            com = getattr(manager, com)
-            if com_name in com.components_dict:
-                return com[com_name]
-        else:
-            if com_name in paddle.optimizer.lr.__all__:
-                return getattr(paddle.optimizer.lr, com_name)
-            elif com_name in paddle.optimizer.__all__:
-                return getattr(paddle.optimizer, com_name)
-            elif com_name in paddle.nn.__all__:
-                return getattr(paddle.nn, com_name)
+        owner = _get_component_manager(com_name)
+        if owner is not None:
+            return owner[com_name]
 
-            raise RuntimeError(
-                'The specified component was not found {}.'.format(com_name))
+        if com_name in _PADDLE_LR_NAMES:
+            return getattr(paddle.optimizer.lr, com_name)
+
+        if com_name in _PADDLE_OPT_NAMES:
+            return getattr(paddle.optimizer, com_name)
+
+        if com_name in _PADDLE_NN_NAMES:
+            return getattr(paddle.nn, com_name)
+
+        raise RuntimeError(
+            'The specified component was not found {}.'.format(com_name))
 
     def _load_component_from_paddleseg(self, com_name: str) -> Any:
         from paddleseg.cvlibs import manager
@@ -267,23 +630,63 @@ class Config(object):
                 com_name))
 
     def _load_object(self, obj: Generic, recursive: bool = True) -> Any:
+        '''Build the components described by obj, children before their parents
+
+        The traversal keeps its own stack instead of recursing, and obj is
+        never modified.
+        '''
+        stack = []
+        value = self._enter_object(stack, None, obj, recursive)
+
+        while stack:
+            frame = stack[-1]
+            for key, val in frame[3]:
+                if key in _META_KEYS:
+                    continue
+
+                child = self._enter_object(stack, key, val)
+                if child is _PENDING:
+                    # Resume this frame once the child frame is built
+                    break
+                _set_param(frame[2], key, child)
+            else:
+                stack.pop()
+                key, component, params, _ = frame
+                value = params if component is None else component(**params)
+                if stack:
+                    _set_param(stack[-1][2], key, value)
+
+        return value
+
+    def _enter_object(self,
+                      stack: List,
+                      key: Any,
+                      obj: Generic,
+                      recursive: bool = True) -> Any:
+        '''Build obj directly if it is a leaf, otherwise push a frame for its children'''
         if isinstance(obj, Mapping):
-            dic = obj.copy()
+            if obj.get('_lazy_', False):
+                dic = {k: v for k, v in obj.items() if k != '_lazy_'}
+                # Defer construction until the returned callable is invoked
+                return functools.partial(
+                    self._load_object, obj=dic, recursive=recursive)
+
             component = self._load_component(
-                dic.pop('type')) if 'type' in dic else dict
+                obj['type']) if 'type' in obj else dict
 
-            if recursive:
-                params = {}
-                for key, val in dic.items():
-                    params[key] = self._load_object(
-                        obj=val, recursive=recursive)
-            else:
-                params = dic
+            # Mappings holding only scalars need no frame of their own
+            if not recursive or not any(
+                    _is_container(val) for val in obj.values()):
+                return component(
+                    **{k: v
+                       for k, v in obj.items() if k not in _META_KEYS})
 
-            return component(**params)
+            stack.append((key, component, {}, iter(obj.items())))
+            return _PENDING
 
-        elif isinstance(obj, Iterable) and not isinstance(obj, str):
-            return [self._load_object(item) for item in obj]
+        elif _is_container(obj):
+            stack.append((key, None, [], zip(itertools.repeat(None), obj)))
+            return _PENDING
 
         return obj
 
@@ -296,18 +699,76 @@ class Config(object):
         msg += '------------------------------------------------'
         return msg
 
-    def to_dict(self) -> Dict:
+    def to_dict(self, parallel: bool = False) -> Dict:
+        '''Build all components and collect them into a dict
+
+        Args:
+            parallel (bool): Build the validation dataset in a background thread
+                while the optimizer, model and training dataset are built. Only
+                enable it if the dataset components are thread-safe to construct.
+        '''
         if self.iters is not None:
             dic = {'iters': self.iters}
         else:
             dic = {'epochs': self.epochs}
 
+        if not parallel:
+            dic.update({
+                'optimizer': self.optimizer,
+                'model': self.model,
+                'train_dataset': self.train_dataset,
+                'val_dataset': self.val_dataset,
+                'batch_size': self.batch_size
+            })
+            return dic
+
+        # The model may depend on the training dataset and the optimizer on the
+        # model, only the validation dataset is independent of the others
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(lambda: self.val_dataset)
+            optimizer = self.optimizer
+            model = self.model
+            train_dataset = self.train_dataset
+            val_dataset = future.result()
+
         dic.update({
-            'optimizer': self.optimizer,
-            'model': self.model,
-            'train_dataset': self.train_dataset,
-            'val_dataset': self.val_dataset,
+            'optimizer': optimizer,
+            'model': model,
+            'train_dataset': train_dataset,
+            'val_dataset': val_dataset,
             'batch_size': self.batch_size
         })
-
         return dic
+
+    @classmethod
+    def compile(cls, path: str) -> Callable[[], paddle.nn.Layer]:
+        '''Generate a builder function for the model of a fixed config
+
+        The builder is written to `<path>.build.py` and calls the model
+        components directly, without resolving them through the managers. It is
+        regenerated whenever one of the yaml files it was created from changes.
+
+        Args:
+            path (str) : The path of config file, supports yaml format only.
+
+        Returns:
+            A function without arguments that builds a new model.
+        '''
+        build_path = _build_path(path)
+        module = _exec_builder(build_path, path)
+        if module is not None and 'build' in module:
+            return module['build']
+
+        cfg = cls(path=path)
+        model_cfg = cfg.dic.get('model')
+        if not model_cfg:
+            raise RuntimeError('No model specified in the configuration file.')
+
+        # Parse-time mtimes, so edits made since then invalidate the builder
+        code = _BuilderWriter(cfg._load_component).write(
+            model_cfg, os.path.realpath(path), cfg._sources)
+        _atomic_write(build_path, code)
+
+        module = {'__name__': '_paddle3d_builder', '__file__': build_path}
+        exec(compile(code, build_path, 'exec'), module)
+        return module['build']
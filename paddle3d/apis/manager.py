@@ -59,6 +59,10 @@ class ComponentManager:
         # {'AlexNet': <class '__main__.AlexNet'>, 'ResNet': <class '__main__.ResNet'>}
     """
 
+    # Number of components added to any manager, lets lookup caches notice
+    # newly registered components
+    _registrations = 0
+
     def __init__(self, *, name: str, description: str = ''):
         self._components_dict = dict()
         self._name = name
@@ -77,6 +81,10 @@ class ComponentManager:
                 item, self))
         return self._components_dict[item]
 
+    @classmethod
+    def registrations(cls) -> int:
+        return cls._registrations
+
     @property
     def components_dict(self) -> dict:
         return self._components_dict
@@ -107,6 +115,7 @@ class ComponentManager:
 
         # Obtain the internal name of the component
         component_name = component.__name__
+        ComponentManager._registrations += 1
 
         # Check whether the component was added already
         if component_name in self._components_dict.keys():
@@ -0,0 +1,553 @@
+import copy
+import functools
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import paddle
+import yaml
+
+import paddle3d
+
+
+def _write_yaml(path, dic):
+    with open(path, 'w') as file:
+        yaml.dump(dic, file)
+
+
+class _Node(object):
+    built = []
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.kwargs = kwargs
+        _Node.built.append(name)
+
+
+def _describe(obj):
+    if isinstance(obj, _Node):
+        return (obj.name, {k: _describe(v) for k, v in obj.kwargs.items()})
+    if isinstance(obj, functools.partial):
+        return ('lazy', obj.keywords['obj'])
+    if isinstance(obj, dict):
+        return {k: _describe(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_describe(v) for v in obj]
+    return obj
+
+
+def _bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+class ConfigParseTestCase(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.tmpdir.name, 'base.yml')
+        self.path = os.path.join(self.tmpdir.name, 'child.yml')
+        self.sidecar_path = self.path + '.cache.json'
+
+        _write_yaml(
+            self.base_path, {
+                'batch_size': 2,
+                'model': {
+                    'type': 'BaseModel',
+                    'depth': 18,
+                    'head': {
+                        'type': 'BaseHead',
+                        'channels': 64
+                    }
+                },
+                'train_dataset': {
+                    'type': 'BaseDataset',
+                    'mode': 'train'
+                }
+            })
+        _write_yaml(
+            self.path, {
+                '_base_': 'base.yml',
+                'iters': 100,
+                'model': {
+                    'depth': 34,
+                    'head': {
+                        '_inherited_': False,
+                        'type': 'ChildHead'
+                    }
+                }
+            })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _plant_marker(self):
+        with open(self.sidecar_path, 'r') as file:
+            sidecar = json.load(file)
+        sidecar['dic']['marker'] = True
+        with open(self.sidecar_path, 'w') as file:
+            json.dump(sidecar, file)
+
+    def test_inheritance(self):
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertEqual(cfg.batch_size, 2)
+        self.assertEqual(cfg.iters, 100)
+        self.assertEqual(cfg.dic['model'], {
+            'type': 'BaseModel',
+            'depth': 34,
+            'head': {
+                'type': 'ChildHead'
+            }
+        })
+        self.assertEqual(cfg.dic['train_dataset'], {
+            'type': 'BaseDataset',
+            'mode': 'train'
+        })
+
+    def test_base_through_symlink(self):
+        # repo/sub -> ../real/sub, `..` in sub/child.yml refers to real/
+        real_sub = os.path.join(self.tmpdir.name, 'real', 'sub')
+        repo = os.path.join(self.tmpdir.name, 'repo')
+        for dirname in ('_base_', 'sub'):
+            os.makedirs(os.path.join(self.tmpdir.name, 'real', dirname))
+        os.makedirs(os.path.join(repo, '_base_'))
+        os.symlink(os.path.join('..', 'real', 'sub'), os.path.join(repo, 'sub'))
+
+        _write_yaml(
+            os.path.join(self.tmpdir.name, 'real', '_base_', 'b.yml'),
+            {'batch_size': 1})
+        _write_yaml(os.path.join(repo, '_base_', 'b.yml'), {'batch_size': 5})
+        _write_yaml(
+            os.path.join(real_sub, 'child.yml'), {'_base_': '../_base_/b.yml'})
+
+        cfg = paddle3d.apis.Config(path=os.path.join(repo, 'sub', 'child.yml'))
+        self.assertEqual(cfg.batch_size, 1)
+
+    def test_inheritance_with_anchors(self):
+        with open(self.base_path, 'w') as file:
+            file.write('train_dataset: &ds {type: X, mode: train}\n'
+                       'val_dataset: *ds\n')
+        _write_yaml(self.path, {
+            '_base_': 'base.yml',
+            'val_dataset': {
+                'mode': 'val'
+            }
+        })
+
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertEqual(cfg.dic['train_dataset'], {
+            'type': 'X',
+            'mode': 'train'
+        })
+        self.assertEqual(cfg.dic['val_dataset'], {'type': 'X', 'mode': 'val'})
+
+    def test_update_dic_not_inherited(self):
+        cfg = paddle3d.apis.Config(path=self.path)
+        dic = {'a': {'_inherited_': False, 'x': 1}, 'b': {'y': 2}}
+        base_dic = {'a': {'z': 3}, 'b': {'y': 1, 'w': 0}, 'c': 1}
+
+        merged = cfg._update_dic(dic, base_dic)
+        self.assertEqual(merged, {'a': {'x': 1}, 'b': {'y': 2, 'w': 0}, 'c': 1})
+        # The not inherited sub-dict is returned without its marker, but the
+        # input itself is left untouched
+        self.assertEqual(dic['a'], {'_inherited_': False, 'x': 1})
+
+    def test_sidecar_hit(self):
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertTrue(os.path.exists(self.sidecar_path))
+
+        self._plant_marker()
+        cached = paddle3d.apis.Config(path=self.path)
+        self.assertTrue(cached.dic['marker'])
+        cached.dic.pop('marker')
+        self.assertEqual(cached.dic, cfg.dic)
+
+    def test_sidecar_invalidated_by_child(self):
+        paddle3d.apis.Config(path=self.path)
+        self._plant_marker()
+
+        _bump_mtime(self.path)
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertNotIn('marker', cfg.dic)
+
+        # The sidecar is rewritten with the new mtimes
+        self._plant_marker()
+        self.assertTrue(paddle3d.apis.Config(path=self.path).dic['marker'])
+
+    def test_sidecar_invalidated_by_base(self):
+        paddle3d.apis.Config(path=self.path)
+        self._plant_marker()
+
+        _write_yaml(self.base_path, {'batch_size': 4})
+        _bump_mtime(self.base_path)
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertNotIn('marker', cfg.dic)
+        self.assertEqual(cfg.batch_size, 4)
+
+    def test_sidecar_invalidated_by_edit_while_parsing(self):
+        dump_sidecar = paddle3d.apis.config._dump_sidecar
+
+        def edit_then_dump(*args):
+            _write_yaml(self.base_path, {'batch_size': 4})
+            _bump_mtime(self.base_path)
+            dump_sidecar(*args)
+
+        with mock.patch.object(paddle3d.apis.config, '_dump_sidecar',
+                               edit_then_dump):
+            cfg = paddle3d.apis.Config(path=self.path)
+        self.assertEqual(cfg.batch_size, 2)
+
+        # The sidecar holds the old content, but not the mtime of the new one
+        self.assertEqual(paddle3d.apis.Config(path=self.path).batch_size, 4)
+
+    def test_sidecar_invalidated_by_copy(self):
+        paddle3d.apis.Config(path=self.path)
+
+        copy_dir = os.path.join(self.tmpdir.name, 'copy')
+        os.mkdir(copy_dir)
+        copy_path = os.path.join(copy_dir, 'child.yml')
+        shutil.copy2(self.sidecar_path, copy_dir)
+        _write_yaml(copy_path, {'batch_size': 99})
+        # The copy keeps the mtime of the original config
+        stat = os.stat(self.path)
+        os.utime(copy_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        cfg = paddle3d.apis.Config(path=copy_path)
+        self.assertEqual(cfg.dic, {'batch_size': 99})
+
+    def test_sidecar_skips_non_json_dict(self):
+        _write_yaml(self.path, {'learning_map': {0: 0, 1: 10}})
+
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertEqual(cfg.dic['learning_map'], {0: 0, 1: 10})
+        self.assertFalse(os.path.exists(self.sidecar_path))
+
+
+class ConfigLoadObjectTestCase(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'model.yml')
+        _write_yaml(self.path, {'batch_size': 1})
+
+        self.cfg = paddle3d.apis.Config(path=self.path)
+        self.cfg._component_cache['Node'] = _Node
+        _Node.built = []
+
+        self.obj = {
+            'type': 'Node',
+            'name': 'root',
+            'backbone': {
+                'type': 'Node',
+                'name': 'backbone',
+                'layers': [{
+                    'type': 'Node',
+                    'name': 'l0'
+                }, [{
+                    'type': 'Node',
+                    'name': 'l1'
+                }, 3]]
+            },
+            'head': {
+                'type': 'Node',
+                'name': 'head',
+                '_lazy_': True,
+                'loss': {
+                    'type': 'Node',
+                    'name': 'loss'
+                }
+            },
+            'neck': {
+                'type': 'Node',
+                'name': 'neck'
+            },
+            'extra': {
+                'scale': 0.5,
+                'inner': {
+                    'type': 'Node',
+                    'name': 'inner'
+                }
+            }
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _load_recursive(self, obj):
+        # Reference implementation, builds children recursively before parents
+        if isinstance(obj, dict):
+            dic = obj.copy()
+            if dic.pop('_lazy_', False):
+                return functools.partial(self._load_recursive, obj=dic)
+            component = self.cfg._load_component(
+                dic.pop('type')) if 'type' in dic else dict
+            return component(
+                **{key: self._load_recursive(val)
+                   for key, val in dic.items()})
+        if isinstance(obj, list):
+            return [self._load_recursive(item) for item in obj]
+        return obj
+
+    def test_post_order(self):
+        snapshot = copy.deepcopy(self.obj)
+        root = self.cfg._load_object(self.obj)
+
+        self.assertEqual(_Node.built,
+                         ['l0', 'l1', 'backbone', 'neck', 'inner', 'root'])
+        self.assertEqual(self.obj, snapshot)
+
+        backbone = root.kwargs['backbone']
+        self.assertEqual(backbone.kwargs['layers'][0].name, 'l0')
+        self.assertEqual(backbone.kwargs['layers'][1][0].name, 'l1')
+        self.assertEqual(backbone.kwargs['layers'][1][1], 3)
+        self.assertEqual(root.kwargs['extra']['scale'], 0.5)
+        self.assertEqual(root.kwargs['extra']['inner'].name, 'inner')
+
+    def test_lazy(self):
+        root = self.cfg._load_object(self.obj)
+        self.assertNotIn('head', _Node.built)
+
+        head = root.kwargs['head']()
+        self.assertEqual(head.name, 'head')
+        self.assertEqual(head.kwargs['loss'].name, 'loss')
+        self.assertEqual(_Node.built[-2:], ['loss', 'head'])
+
+    def test_matches_recursive(self):
+        expected = _describe(self._load_recursive(self.obj))
+        expected_order = _Node.built
+        _Node.built = []
+
+        self.assertEqual(_describe(self.cfg._load_object(self.obj)), expected)
+        self.assertEqual(_Node.built, expected_order)
+
+    def test_not_recursive(self):
+        root = self.cfg._load_object(self.obj['neck'], recursive=False)
+        self.assertEqual(root.name, 'neck')
+
+        root = self.cfg._load_object(self.obj, recursive=False)
+        self.assertEqual(root.kwargs['neck'], self.obj['neck'])
+        self.assertEqual(_Node.built, ['neck', 'root'])
+
+
+class ConfigToDictTestCase(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'model.yml')
+        _write_yaml(
+            self.path, {
+                'batch_size': 4,
+                'iters': 10,
+                'model': {
+                    'type': 'Linear',
+                    'in_features': 2,
+                    'out_features': 3
+                },
+                'lr_scheduler': {
+                    'type': 'PiecewiseDecay',
+                    'boundaries': [5],
+                    'values': [0.1, 0.01]
+                },
+                'optimizer': {
+                    'type': 'SGD'
+                },
+                'train_dataset': {
+                    'type': 'Node',
+                    'name': 'train'
+                },
+                'val_dataset': {
+                    'type': 'Node',
+                    'name': 'val',
+                    'transforms': [{
+                        'type': 'Node',
+                        'name': 'transform'
+                    }]
+                }
+            })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _to_dict(self, parallel):
+        cfg = paddle3d.apis.Config(path=self.path)
+        cfg._component_cache['Node'] = _Node
+        dic = cfg.to_dict(parallel=parallel)
+        self.assertIs(dic['model'], cfg.model)
+        self.assertIs(dic['val_dataset'], cfg.val_dataset)
+        return {
+            key: type(val).__name__ if isinstance(
+                val, (paddle.nn.Layer, paddle.optimizer.Optimizer)) else
+            _describe(val)
+            for key, val in dic.items()
+        }
+
+    def test_parallel_matches_serial(self):
+        self.assertEqual(self._to_dict(parallel=True),
+                         self._to_dict(parallel=False))
+
+
+class ConfigComponentIndexTestCase(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'model.yml')
+        _write_yaml(self.path, {'batch_size': 1})
+        self.added = []
+
+    def tearDown(self):
+        for com, name in self.added:
+            com.components_dict.pop(name, None)
+        self.tmpdir.cleanup()
+
+    def _add_component(self, com, name):
+        component = type(name, (object, ), {})
+        com.add_component(component)
+        self.added.append((com, name))
+        return component
+
+    def test_new_registration(self):
+        cfg = paddle3d.apis.Config(path=self.path)
+        # Build the index before the component exists
+        self.assertIsNone(
+            paddle3d.apis.config._get_component_manager('_IndexedModel'))
+
+        component = self._add_component(paddle3d.apis.manager.MODELS,
+                                        '_IndexedModel')
+        self.assertIs(cfg._load_component('_IndexedModel'), component)
+
+    def test_first_manager_wins(self):
+        manager = paddle3d.apis.manager
+        self.assertLess(
+            manager.__all__.index('BACKBONES'), manager.__all__.index('MODELS'))
+
+        self._add_component(manager.MODELS, '_DuplicatedName')
+        backbone = self._add_component(manager.BACKBONES, '_DuplicatedName')
+
+        cfg = paddle3d.apis.Config(path=self.path)
+        self.assertIs(cfg._load_component('_DuplicatedName'), backbone)
+
+
+class ConfigCompileTestCase(unittest.TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'linear.yml')
+        self.build_path = self.path + '.build.py'
+        _write_yaml(self.path, {
+            'model': {
+                'type': 'Linear',
+                'in_features': 2,
+                'out_features': 3
+            }
+        })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_matches_model(self):
+        paddle.seed(1)
+        model = paddle3d.apis.Config(path=self.path).model
+
+        build = paddle3d.apis.Config.compile(self.path)
+        self.assertTrue(os.path.exists(self.build_path))
+        paddle.seed(1)
+        compiled = build()
+
+        self.assertIs(type(compiled), type(model))
+        np.testing.assert_allclose(compiled.weight.numpy(),
+                                   model.weight.numpy())
+
+        # A fresh builder is loaded from disk and behaves the same
+        paddle.seed(1)
+        cached = paddle3d.apis.Config.compile(self.path)()
+        np.testing.assert_allclose(cached.weight.numpy(),
+                                   model.weight.numpy())
+
+    def test_regenerate_after_edit(self):
+        build = paddle3d.apis.Config.compile(self.path)
+        self.assertEqual(list(build().weight.shape), [2, 3])
+
+        _write_yaml(self.path, {
+            'model': {
+                'type': 'Linear',
+                'in_features': 2,
+                'out_features': 4
+            }
+        })
+        _bump_mtime(self.path)
+
+        build = paddle3d.apis.Config.compile(self.path)
+        self.assertEqual(list(build().weight.shape), [2, 4])
+
+    def test_regenerate_after_edit_while_compiling(self):
+        path = self.path
+
+        class EditingConfig(paddle3d.apis.Config):
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                # Saved after the config was parsed, but before compiling
+                _write_yaml(path, {
+                    'model': {
+                        'type': 'Linear',
+                        'in_features': 2,
+                        'out_features': 4
+                    }
+                })
+                _bump_mtime(path)
+
+        build = EditingConfig.compile(self.path)
+        self.assertEqual(list(build().weight.shape), [2, 3])
+
+        build = paddle3d.apis.Config.compile(self.path)
+        self.assertEqual(list(build().weight.shape), [2, 4])
+
+    def test_stale_builder_not_executed(self):
+        marker_path = os.path.join(self.tmpdir.name, 'executed')
+        with open(self.build_path, 'w') as file:
+            source = os.path.realpath(self.path)
+            file.write('SOURCE = {!r}\n'.format(source))
+            file.write('MTIMES = {!r}\n'.format({source: 0}))
+            file.write('open({!r}, "w").close()\n'.format(marker_path))
+
+        build = paddle3d.apis.Config.compile(self.path)
+        self.assertEqual(list(build().weight.shape), [2, 3])
+        self.assertFalse(os.path.exists(marker_path))
+
+    def test_copied_builder_not_executed(self):
+        paddle3d.apis.Config.compile(self.path)
+
+        copy_dir = os.path.join(self.tmpdir.name, 'copy')
+        os.mkdir(copy_dir)
+        copy_path = os.path.join(copy_dir, 'linear.yml')
+        shutil.copy2(self.build_path, copy_dir)
+        _write_yaml(copy_path, {
+            'model': {
+                'type': 'Linear',
+                'in_features': 2,
+                'out_features': 7
+            }
+        })
+        # The copy keeps the mtime of the original config
+        stat = os.stat(self.path)
+        os.utime(copy_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        build = paddle3d.apis.Config.compile(copy_path)
+        self.assertEqual(list(build().weight.shape), [2, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
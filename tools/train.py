@@ -79,6 +79,12 @@ def parse_args():
         help='Num workers for data loader',
         type=int,
         default=2)
+    parser.add_argument(
+        '--parallel_build',
+        dest='parallel_build',
+        help=
+        'Build the validation dataset in a background thread while the model is built',
+        action='store_true')
     parser.add_argument(
         '--resume',
         dest='resume',
@@ -143,7 +149,7 @@ def main(args):
     logger.info('\n{}'.format(paddle3d_env.get_env_info()))
     logger.info('\n{}'.format(cfg))
 
-    dic = cfg.to_dict()
+    dic = cfg.to_dict(parallel=args.parallel_build)
     batch_size = dic.pop('batch_size')
     dic.update({
         'resume': args.resume,